@@ -3,12 +3,41 @@ Email
 """
 
 import re
+import sys
 import base64
 import mimetypes
-from socket import socket, AF_INET, SOCK_STREAM, getfqdn, gethostname
+from functools import cache
+from socket import socket, AF_INET, SOCK_STREAM, IPPROTO_TCP, TCP_NODELAY, getfqdn, gethostname
 from parse import *
 from exceptions import *
 
+# Pattern used to extract the domain name from a forward path of the form <local-part@domain>
+_DOMAIN_RE = re.compile(r"@([^>]+)>")
+
+# Pre-encoded SMTP command prefixes and constant messages
+_HELO_P = b"HELO "
+_MAIL_FROM_P = b"MAIL FROM: "
+_RCPT_TO_P = b"RCPT TO: "
+_NL = b"\n"
+_DATA_CMD = b"DATA\n"
+_QUIT_CMD = b"QUIT\n"
+_EOMD = b".\n"
+
+# Maximum number of buffers passed to a single sendmsg call (the IOV_MAX of Linux and macOS)
+_IOV_MAX = 1024
+# Number of bytes of message parts gathered before they are sent (so that streamed parts, such as
+# the base64-encoded attachment chunks, are not all held in memory at once)
+_SEND_BATCH_SIZE = 1024 * 1024
+
+# Sent message types that are single SMTP command messages (as opposed to message data or nothing)
+_SENT_CMDS = frozenset({"HELO", "MAIL_FROM", "RCPT_TO", "DATA", "QUIT"})
+
+@cache
+def _get_local_fqdn():
+    """Returns the fully qualified domain name of the local host, performing the (potentially slow)
+        lookup only on the first call of the process."""
+    return getfqdn()
+
 class Email:
     """A class used by agent_client and server to temporarily store and manipulate email data as an email object."""
 
@@ -16,49 +45,77 @@ class Email:
     # check for the end-of-message-data sequence <CRLF>.<CRLF>
     EOMD_SEQ = ".\n"
 
+    # Number of attachment bytes read and base64-encoded at a time (a multiple of the 57 bytes
+    # encoded on each 76-character line of base64 output)
+    ATTACHMENT_CHUNK_SIZE = 57 * 1024
+
+    __slots__ = ("_reverse_path", "_forward_paths", "_encoded_forward_paths", "_subject",
+                 "_message_body", "_attachment_filename", "_attachment_mime_type",
+                 "_data_payload_parts", "_pending_input_lines")
+
     def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Clears all email data, leaving the email object as if newly created (so that it can be
+            reused for a new email)."""
         self._reverse_path = ""
         self._forward_paths = []
+        # Encoded counterparts of the forward paths (kept alongside them for use while sending)
+        self._encoded_forward_paths = []
         self._subject = ""
-        self._message_lines = []
+        # Encoded message data lines, accumulated contiguously
+        self._message_body = bytearray()
         self._attachment_filename = ""
+        # MIME content type of the attachment (guessed from its filename when set)
+        self._attachment_mime_type = ""
+        # Encoded parts of the message data payload preceding the attachment (built on first send,
+        # discarded whenever the email is modified)
+        self._data_payload_parts = None
+        # Lines of user input already read from a non-interactive stdin but not yet consumed
+        self._pending_input_lines = []
 
     def set_reverse_path(self, reverse_path):
         self._reverse_path = reverse_path
+        self._data_payload_parts = None
 
     def add_forward_path(self, forward_path):
         self._forward_paths.append(forward_path)
+        self._encoded_forward_paths.append(forward_path.encode())
+        self._data_payload_parts = None
 
     def set_forward_paths(self, forward_paths):
         self._forward_paths = forward_paths
+        self._encoded_forward_paths = [forward_path.encode() for forward_path in forward_paths]
+        self._data_payload_parts = None
 
     def set_subject(self, subject):
         self._subject = subject
+        self._data_payload_parts = None
 
     def add_message_line(self, message_line):
-        self._message_lines.append(message_line)
+        self._message_body += message_line.encode()
+        self._data_payload_parts = None
+
+    def add_encoded_message_line(self, encoded_message_line):
+        self._message_body += encoded_message_line
+        self._data_payload_parts = None
 
     def set_attachment_filename(self, attachment_filename):
         self._attachment_filename = attachment_filename
+        self._attachment_mime_type = (mimetypes.guess_type(attachment_filename)[0]
+                                      or "application/octet-stream")
+        self._data_payload_parts = None
 
     def domain_specific_forward_file_names(self):
         """Returns as a set the set of domain names found amongst the forward paths that are associated
             with the email at hand (for purposes of domain-specific forward file creation)."""
-        return {re.search("@.*>", forward_path)[0][1:-1] for forward_path in self._forward_paths}
+        return set(_DOMAIN_RE.findall(",".join(self._forward_paths)))
 
-    def forward_file_ready_text_lines(self):
-        '''Generator generating line strings that, when iterated through, can be used collectively
-            to textually represent the details of the email in the format:
-                From: <reverse-path>
-                To: <forward-path-1>
-                          .
-                          .
-                          .
-                To: <forward-path-n>
-                These are two sample message data lines included
-                for illustrative purposes.'''
-        for message_line in self._message_lines:
-            yield message_line
+    def forward_file_ready_bytes(self):
+        '''Returns the email's encoded message data lines (accumulated in _message_body) as a single
+            bytes object, ready to be appended to a forward file opened in binary mode.'''
+        return bytes(self._message_body)
 
     def fill(self):
         """Method for soliciting, obtaining, and storing email data from a command-line user."""
@@ -71,36 +128,44 @@ class Email:
     def _fill_reverse_path(self):
         while True:
             try:
-                mailbox_input_string = input("From:\n")
+                mailbox_input_string = self._input("From:\n")
             except EOFError:
                 raise EarlyTerminationError()
             else:
-                try:
-                    mailbox_input_string_rem_string = RemainingString(mailbox_input_string)
-                    parse_mailbox(mailbox_input_string_rem_string)
-                except ParsingError as e:
+                mailbox_input_string_rem_string = RemainingString(mailbox_input_string)
+                error_name = parse_mailbox_nothrow(mailbox_input_string_rem_string)
+                if error_name is not None:
                     print("Invalid <mailbox> provided for reverse-path: error parsing for <" 
-                          + str(e) + "> production rule.")
+                          + error_name + "> production rule.")
+                elif mailbox_input_string_rem_string.has_further_chars():
+                    print("Invalid <mailbox> provided for reverse-path: error parsing for <" 
+                          "mailbox> production rule.")
                 else:
-                    if mailbox_input_string_rem_string.has_further_chars():
-                        print("Invalid <mailbox> provided for reverse-path: error parsing for <" 
-                              "mailbox> production rule.")
-                    else:
-                        self.set_reverse_path("<" + mailbox_input_string + ">")
-                        break
+                    self.set_reverse_path("<" + mailbox_input_string + ">")
+                    break
 
     def _fill_forward_paths(self):
         while True:
             try:
-                mailboxes_input_string = input("To:\n")
+                mailboxes_input_string = self._input("To:\n")
             except EOFError:
                 raise EarlyTerminationError()
             else:
-                try:
-                    parse_comma_sep_mailboxes(RemainingString(mailboxes_input_string))
-                except ParsingError as e:
+                if "," not in mailboxes_input_string:
+                    # Single recipient (the common case): parse as a lone <mailbox>, which, not being
+                    # followed by a comma, must make up the entire <comma-sep-mailboxes>
+                    mailboxes_input_string_rem_string = RemainingString(mailboxes_input_string)
+                    error_name = parse_mailbox_nothrow(mailboxes_input_string_rem_string)
+                    if error_name is None and mailboxes_input_string_rem_string.has_further_chars():
+                        error_name = "comma-sep-mailboxes"
+                else:
+                    error_name = parse_comma_sep_mailboxes_nothrow(RemainingString(mailboxes_input_string))
+                if error_name is not None:
                     print("Invalid <mailbox> sequence for forward-paths: error parsing for <" 
-                          + str(e) + "> production rule.")
+                          + error_name + "> production rule.")
+                elif "," not in mailboxes_input_string:
+                    self.set_forward_paths(["<" + mailboxes_input_string + ">"])
+                    break
                 else:
                     forward_paths = ["<" + mailbox.strip() + ">" for mailbox in mailboxes_input_string.split(",")]
                     self.set_forward_paths(forward_paths)
@@ -108,7 +173,7 @@ class Email:
 
     def _fill_subject(self):
         try:
-            subject = input("Subject:\n")
+            subject = self._input("Subject:\n")
         except EOFError:
             raise EarlyTerminationError()
         else:
@@ -116,9 +181,22 @@ class Email:
 
     def _fill_message_lines(self):
         print("Message:")
+        if not self._pending_input_lines and not sys.stdin.isatty():
+            # Read piped input all at once and split it into lines in bulk rather than line by line
+            input_lines = sys.stdin.read().split("\n")
+            if input_lines[-1] == "":
+                input_lines.pop()
+            try:
+                eomd_seq_index = input_lines.index(Email.EOMD_SEQ.rstrip("\n"))
+            except ValueError:
+                raise EarlyTerminationError()
+            self._message_body += "".join(line + "\n" for line in input_lines[:eomd_seq_index]).encode()
+            self._data_payload_parts = None
+            self._pending_input_lines = input_lines[eomd_seq_index + 1:]
+            return
         while True:
             try:
-                line = input() + "\n"
+                line = self._input() + "\n"
             except EOFError:
                 raise EarlyTerminationError()
             else:
@@ -131,12 +209,20 @@ class Email:
         print("Attachment:")
         try:
             # Assumes a valid filename
-            filename = input()
+            filename = self._input()
         except EOFError:
             raise EarlyTerminationError()
         else:
             self.set_attachment_filename(filename)
 
+    def _input(self, prompt=""):
+        """Returns the next line of user input (as input() would), drawing first from any lines
+            already read from stdin in bulk."""
+        if self._pending_input_lines:
+            print(prompt, end="")
+            return self._pending_input_lines.pop(0)
+        return input(prompt)
+
     def send(self, server_hostname, welc_sock_port_num):
         """Method for sending a complete email to the address specified by the provided (string) server
         hostname and (integer) welcoming socket port number using SMTP."""
@@ -145,67 +231,118 @@ class Email:
         try:
             client_socket = socket(AF_INET, SOCK_STREAM)
             client_socket.connect((server_hostname, welc_sock_port_num))
+            # Disable Nagle's algorithm so that small command messages are not delayed
+            client_socket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+            # Read server responses through a buffer so that they can be read line by line
+            server_response_file = client_socket.makefile('rb', buffering=8192)
         # Raise SocketError exception on error
         except Exception as e:
             print("Error creating client socket and/or initiating connection. Exception raised: " + str(e) + "\n")
             raise SocketError()
 
         # Receive and validate server's 220 response code greeting message
-        self._receive_and_validate("220", client_socket, None, None)
+        self._receive_and_validate("220", client_socket, server_response_file, None, None)
 
         # Send "HELO" message
-        sent_msg = self._send_msg(self._get_helo_msg(), client_socket)
+        sent_msg = self._send_msg(self._get_helo_msg(), client_socket, server_response_file)
         # Receive and validate server's 250 response code acknowledgement message
-        self._receive_and_validate("250", client_socket, "HELO", sent_msg)
+        self._receive_and_validate("250", client_socket, server_response_file, "HELO", sent_msg)
 
         # Send "MAIL FROM" command message
-        sent_msg = self._send_msg(self._get_mail_from_cmd(), client_socket)
+        sent_msg = self._send_msg(self._get_mail_from_cmd(), client_socket, server_response_file)
         # Receive and validate server's 250 response code message
-        self._receive_and_validate("250", client_socket, "MAIL_FROM", sent_msg)
+        self._receive_and_validate("250", client_socket, server_response_file, "MAIL_FROM", sent_msg)
 
         # Send "RCPT TO" command messages, receive and validate server's 250 response code messagess
         for rcpt_to_cmd in self._get_rcpt_to_cmds():
             # Send "RCPT TO" command message
-            sent_msg = self._send_msg(rcpt_to_cmd, client_socket)
+            sent_msg = self._send_msg(rcpt_to_cmd, client_socket, server_response_file)
             # Receive an validate server's 250 response code message
-            self._receive_and_validate("250", client_socket, "RCPT_TO", sent_msg)
+            self._receive_and_validate("250", client_socket, server_response_file, "RCPT_TO", sent_msg)
 
         # Send "DATA" command message
-        sent_msg = self._send_msg(self._get_data_cmd(), client_socket)
+        sent_msg = self._send_msg(self._get_data_cmd(), client_socket, server_response_file)
         # Receive and validate server's 354 response code message
-        self._receive_and_validate("354", client_socket, "DATA", sent_msg)
+        self._receive_and_validate("354", client_socket, server_response_file, "DATA", sent_msg)
 
-        # Send SMTP message data lines followed by end-of-message-data sequence
-        for data_line in self._get_SMTP_MIME_message_data_lines():
-            self._send_msg(data_line, client_socket)
-        self._send_msg(self._get_eomd_seq(), client_socket)
+        # Send SMTP message data lines followed by end-of-message-data sequence (as a single payload)
+        self._send_msg_parts(self._get_data_payload_parts(), client_socket, server_response_file)
         # Receive and validate server's 250 response code message
-        self._receive_and_validate("250", client_socket, "MESSAGE_DATA", None)
+        self._receive_and_validate("250", client_socket, server_response_file, "MESSAGE_DATA", None)
 
         # Send "QUIT" command message
-        sent_msg = self._send_msg(self._get_quit_cmd(), client_socket)
+        sent_msg = self._send_msg(self._get_quit_cmd(), client_socket, server_response_file)
         # Receive and validate server's 221 response code closing message
-        self._receive_and_validate("221", client_socket, "QUIT", sent_msg)
+        self._receive_and_validate("221", client_socket, server_response_file, "QUIT", sent_msg)
+
+        # Close connection
+        self._close_connection(client_socket, server_response_file)
 
 
-    def _send_msg(self, msg, client_socket):
+    def _close_connection(self, client_socket, server_response_file):
+        """Closes the provided client socket's connection along with the provided buffered reader over it."""
+        server_response_file.close()
+        client_socket.close()
+
+    def _send_msg(self, msg, client_socket, server_response_file):
         """Given an encoded message, sends this message into the provided client socket and returns it.
         Raises a SocketError if any exceptions are encountered as a result of the sending process. Before
         raising any exceptions, this procedure will close the socket's connection and print a descriptive
         1-line error message."""
         try:
-            client_socket.send(msg)
+            client_socket.sendall(msg)
         except Exception:
-            client_socket.close()
+            self._close_connection(client_socket, server_response_file)
             print("Error sending the following message: " + msg.decode().rstrip("\n") + "\n")
             raise SocketError()
         return msg
 
-    def _receive_and_validate(self, expected_msg_type, client_socket, sent_msg_type, sent_msg):
-        """Given a message type, a client socket, and the prior (encoded) message sent into the client
-        socket (along with its type), recieves a message from the socket and validates that that message
-        conforms to the SMTP protocol grammar production rule associated with the provided expected message
-        type. Raises a SMTPBreakOfProtocolError if this is not found to be the case. Raises a SocketError in
+    def _send_msg_parts(self, msg_parts, client_socket, server_response_file):
+        """Given an iterable of encoded message parts, sends the concatenation of these parts into the
+        provided client socket without first joining them all, gathering the parts into batches of up to
+        about _SEND_BATCH_SIZE bytes as they are iterated through. Raises a SocketError if any exceptions
+        are encountered as a result of the sending process. Before raising any exceptions, this procedure
+        will close the socket's connection and print a descriptive 1-line error message."""
+        try:
+            batch, batch_size = [], 0
+            for msg_part in msg_parts:
+                if not msg_part:
+                    continue
+                batch.append(memoryview(msg_part))
+                batch_size += len(msg_part)
+                if batch_size >= _SEND_BATCH_SIZE or len(batch) == _IOV_MAX:
+                    self._send_batch(batch, client_socket)
+                    batch, batch_size = [], 0
+            self._send_batch(batch, client_socket)
+        except Exception:
+            self._close_connection(client_socket, server_response_file)
+            print("Error sending message data.\n")
+            raise SocketError()
+
+    def _send_batch(self, batch, client_socket):
+        """Sends the concatenation of the provided list of (at most _IOV_MAX) message part memoryviews
+        into the provided client socket (using scatter-gather sendmsg calls, where available, and resending
+        the unsent remainder after any partial send)."""
+        if not hasattr(client_socket, "sendmsg"):
+            client_socket.sendall(b"".join(batch))
+            return
+        first_unsent = 0
+        while first_unsent < len(batch):
+            num_bytes_sent = client_socket.sendmsg(batch[first_unsent:])
+            # Skip past the fully sent parts and trim the partially sent part (if any)
+            while num_bytes_sent > 0:
+                if num_bytes_sent >= len(batch[first_unsent]):
+                    num_bytes_sent -= len(batch[first_unsent])
+                    first_unsent += 1
+                else:
+                    batch[first_unsent] = batch[first_unsent][num_bytes_sent:]
+                    num_bytes_sent = 0
+
+    def _receive_and_validate(self, expected_msg_type, client_socket, server_response_file, sent_msg_type, sent_msg):
+        """Given a message type, a client socket and the buffered reader over it, and the prior (encoded)
+        message sent into the client socket (along with its type), recieves a (possibly multiline) message from the socket and validates
+        that that message conforms to the SMTP protocol grammar production rule associated with the provided
+        expected message type. Raises a SMTPBreakOfProtocolError if this is not found to be the case. Raises a SocketError in
         the case that an exception occurs while trying to receive from the client socket. Before raising
         any exceptions, this procedure will close the socket's connection and print a descriptive 1-line
         error message. The message types should be provided as strings based on the following tables:
@@ -225,16 +362,18 @@ class Email:
         the sent message type is of type "MESSAGE_DATA", None should be provided for sent_msg.
         """
 
-        # Receive message:
+        # Receive message (reading further lines while the response code is followed by a "-",
+        # as is the case for all but the last line of a multiline response):
         try:
-            msg_str = client_socket.recv(1024).decode()
+            msg_lines = []
+            while True:
+                msg_lines.append(server_response_file.readline().decode())
+                if msg_lines[-1][3:4] != "-":
+                    break
+            msg_str = "".join(msg_lines)
         except Exception:
             # Determine appropriate output on error
-            if (sent_msg_type == "HELO"
-                    or sent_msg_type == "MAIL_FROM"
-                    or sent_msg_type == "RCTP_TO"
-                    or sent_msg_type == "DATA"
-                    or sent_msg_type == "QUIT"):
+            if sent_msg_type in _SENT_CMDS:
                 rec_error_output = ("Error receiving server response. Sent: "
                         + sent_msg.decode().rstrip("\n"))
             elif sent_msg_type == "MESSAGE_DATA":
@@ -243,30 +382,19 @@ class Email:
             elif sent_msg_type == None:
                 rec_error_output = "Error receiving server greeting."
             # Close connection, alert, and raise exception
-            client_socket.close()
+            self._close_connection(client_socket, server_response_file)
             print(rec_error_output)
             raise SocketError()
 
         # Validate that message is of expected type:
         try:
-            # Determine appropriate parsing procedure
-            if expected_msg_type == "220":
-                parsing_procedure = parse_220_resp_code_msg
-            elif expected_msg_type == "221":
-                parsing_procedure = parse_221_resp_code_msg
-            elif expected_msg_type == "250":
-                parsing_procedure = parse_250_resp_code_msg
-            elif expected_msg_type == "354":
-                parsing_procedure = parse_354_resp_code_msg
-            # Parse received message string
-            parsing_procedure(RemainingString(msg_str))
+            # Validate each line of the received message (any continuation lines of a multiline
+            # response and the final line) against the expected response code
+            for msg_line in msg_lines:
+                parse_resp_code_msg_fast(msg_line, expected_msg_type)
         except ParsingError:
             # Determine appropriate output on error
-            if (sent_msg_type == "HELO"
-                    or sent_msg_type == "MAIL_FROM"
-                    or sent_msg_type == "RCPT_TO"
-                    or sent_msg_type == "DATA"
-                    or sent_msg_type == "QUIT"):
+            if sent_msg_type in _SENT_CMDS:
                 val_error_output = ("unexpected server response. Sent "
                         + sent_msg.decode().rstrip("\n") + ". Received: "
                         + msg_str.rstrip("\n"))
@@ -277,22 +405,22 @@ class Email:
                 val_error_output = ("Unexpected server greeting. Received: "
                     + msg_str.rstrip("\n"))
             # Close connection, alert, and raise exception
-            client_socket.close()
+            self._close_connection(client_socket, server_response_file)
             print(val_error_output)
             raise SMTPBreakOfProtocolError()
 
     def _get_helo_msg(self):
-        return ("HELO " + getfqdn() + "\n").encode()
+        return _HELO_P + _get_local_fqdn().encode() + _NL
 
     def _get_mail_from_cmd(self):
-        return ("MAIL FROM: " + self._reverse_path + "\n").encode()
+        return _MAIL_FROM_P + self._reverse_path.encode() + _NL
 
     def _get_rcpt_to_cmds(self):
-        for forward_path in self._forward_paths:
-            yield ("RCPT TO: " + forward_path + "\n").encode()
+        for encoded_forward_path in self._encoded_forward_paths:
+            yield _RCPT_TO_P + encoded_forward_path + _NL
 
     def _get_data_cmd(self):
-        return ("DATA\n").encode()
+        return _DATA_CMD
 
     def _get_SMTP_message_data_lines(self):
         """Generator generating line strings that, when iterated through, can be used collectively
@@ -303,12 +431,11 @@ class Email:
                 These are three sample SMTP message data body lines included
                 for illustrative purposes. Note the blank line preceding
                 these lines."""
-        yield ("From: " + self._reverse_path + "\n").encode()
-        yield ("To: " + ", ".join(self._forward_paths) + "\n").encode()
-        yield ("Subject: " + self._subject + "\n").encode()
-        yield ("\n").encode()
-        for message_line in self._message_lines:
-            yield (message_line).encode()
+        yield b"From: " + self._reverse_path.encode() + _NL
+        yield b"To: " + b", ".join(self._encoded_forward_paths) + _NL
+        yield b"Subject: " + self._subject.encode() + _NL
+        yield _NL
+        yield bytes(self._message_body)
 
     def _get_SMTP_MIME_message_data_lines(self):
         """Generator generating line strings that, when iterated through, can be used collectively
@@ -336,30 +463,52 @@ class Email:
                 --98766789--
                 
         """
-        yield ("From: " + self._reverse_path + "\n").encode()
-        yield ("To: " + ", ".join(self._forward_paths) + "\n").encode()
-        yield ("Subject: " + self._subject + "\n").encode()
-        yield ("MIME-Version: 1.0\n").encode()
-        yield ("Content-Type: multipart/mixed; boundary=98766789\n").encode()
-        yield ("\n").encode()
-        yield ("--98766789\n").encode()
-        yield ("Content-Transfer-Encoding: quoted-printable\n").encode()
-        yield ("Content-Type: text/plain\n").encode()
-        yield ("\n").encode()
-        for message_line in self._message_lines:
-            yield (message_line).encode()
-        yield ("--98766789\n").encode()
-        yield ("Content-Transfer-Encoding: base64\n").encode()
-        yield ("Content-Type: " + mimetypes.guess_type(self._attachment_filename)[0]
-                + "\n").encode()
-        yield ("\n").encode()
+        yield from self._get_SMTP_MIME_message_data_lines_before_attachment()
+        yield from self._get_attachment_base64_chunks()
+        yield b"--98766789--\n"
+
+    def _get_SMTP_MIME_message_data_lines_before_attachment(self):
+        """Generator generating the lines generated by _get_SMTP_MIME_message_data_lines that precede
+            the base64 encoding of the attachment."""
+        yield b"From: " + self._reverse_path.encode() + _NL
+        yield b"To: " + b", ".join(self._encoded_forward_paths) + _NL
+        yield b"Subject: " + self._subject.encode() + _NL
+        yield b"MIME-Version: 1.0\n"
+        yield b"Content-Type: multipart/mixed; boundary=98766789\n"
+        yield _NL
+        yield b"--98766789\n"
+        yield b"Content-Transfer-Encoding: quoted-printable\n"
+        yield b"Content-Type: text/plain\n"
+        yield _NL
+        yield bytes(self._message_body)
+        yield b"--98766789\n"
+        yield b"Content-Transfer-Encoding: base64\n"
+        yield b"Content-Type: " + self._attachment_mime_type.encode() + _NL
+        yield _NL
+
+    def _get_attachment_base64_chunks(self):
+        """Generator generating the base64 encoding of the attachment, a chunk of lines at a time."""
         with open(self._attachment_filename, 'rb') as attachment:
-            base_64_encoded_attachment = base64.encodebytes(attachment.read())
-        yield base_64_encoded_attachment
-        yield ("--98766789--\n").encode()
+            # Encode the attachment incrementally, a whole number of 57-byte (76 base64 character)
+            # lines at a time, so that the raw attachment is never held in memory all at once
+            while attachment_chunk := attachment.read(Email.ATTACHMENT_CHUNK_SIZE):
+                yield base64.encodebytes(attachment_chunk)
+
+    def _get_data_payload_parts(self):
+        """Generator generating the encoded parts of the message data payload: the multipart MIME-encoded
+            data lines generated by _get_SMTP_MIME_message_data_lines followed by the end-of-message-data
+            sequence (so that the message data can be sent into a socket in batches rather than line by
+            line). The parts preceding the attachment are built once and reused by subsequent sends of
+            the unmodified email, while the attachment is re-encoded, and streamed, on each send."""
+        if self._data_payload_parts is None:
+            self._data_payload_parts = list(self._get_SMTP_MIME_message_data_lines_before_attachment())
+        yield from self._data_payload_parts
+        yield from self._get_attachment_base64_chunks()
+        yield b"--98766789--\n"
+        yield self._get_eomd_seq()
 
     def _get_eomd_seq(self):
-        return (Email.EOMD_SEQ).encode()
+        return _EOMD
 
     def _get_quit_cmd(self):
-        return ("QUIT\n").encode()
+        return _QUIT_CMD
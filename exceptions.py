@@ -2,11 +2,6 @@
 Exceptions
 """
 
-class ConsumptionError(Exception):
-    """Exception raised when 'consume' fails to match a given regexp pattern with the beginning of
-        the remaining string, (and therefore also fails to consume it)."""
-    pass
-
 class ParsingError(Exception):
     """Exception raised when an invalid character sequence is encountered whilst parsing the remaining
         string under a given production rule. Passes along as a message the name of the
@@ -16,81 +16,50 @@ class Message:
     _DATA = 4
     _QUIT = 5
 
-    def __init__(self, ms):
+    # Parsing function and message type associated with each (encoded) message's leading 4-byte verb
+    _VERB_DISPATCH = {
+        b"HELO": (parse_helo_msg, _HELO),
+        b"MAIL": (parse_mail_from_cmd, _MAIL_FROM),
+        b"RCPT": (parse_rcpt_to_cmd, _RCPT_TO),
+        b"DATA": (parse_data_cmd, _DATA),
+        b"QUIT": (parse_quit_cmd, _QUIT),
+    }
 
-        # Attempt init as HELO message
-        try:
-            parse_helo_msg(RemainingString(ms))
-        except MessageParsingError:
-            pass
-        except ParameterArgumentParsingError:
-            self._msg_type = Message._HELO
-            self._param_arg_error = True
-            return
-        else:
-            self._msg_type = Message._HELO
-            self._param_arg_error = False
-            return
+    __slots__ = ("_msg_type", "_param_arg_error", "_path")
 
-        # Attempt init as MAIL_FROM command
-        try:
-            parse_mail_from_cmd(RemainingString(ms))
-        except MessageParsingError:
-            pass
-        except ParameterArgumentParsingError:
-            self._msg_type = Message._MAIL_FROM
-            self._param_arg_error = True
-            return
-        else:
-            self._msg_type = Message._MAIL_FROM
-            self._param_arg_error = False
-            return
-
-        # Attempt init as RCPT_TO command
-        try:
-            parse_rcpt_to_cmd(RemainingString(ms))
-        except MessageParsingError:
-            pass
-        except ParameterArgumentParsingError:
-            self._msg_type = Message._RCPT_TO
-            self._param_arg_error = True
-            return
-        else:
-            self._msg_type = Message._RCPT_TO
-            self._param_arg_error = False
+    def __init__(self, ms):
+        """Initializes the message from the encoded (UTF-8) message ms."""
+
+        # Select the single candidate parsing function based on the message's verb
+        # (if the verb is not one of HELO, MAIL, RCPT, DATA, or QUIT, init as UNRECOGNIZED)
+        dispatch_entry = Message._VERB_DISPATCH.get(ms[:4])
+        self._path = None # Only set for 'MAIL FROM' and 'RCPT TO' commands with valid parameters and arguments
+        if dispatch_entry is None:
+            self._msg_type = Message._UNRECOGNIZED
+            self._param_arg_error = False # If an unrecognized command, defaults to no ParameterArgumentParsingError
             return
+        parsing_procedure, msg_type = dispatch_entry
 
-        # Attempt init as DATA command
+        # Attempt init as the message type associated with the verb, matching a well-formed message
+        # directly on its encoding, and only decoding and parsing a malformed one (to discern what
+        # type of ParsingError it raises)
         try:
-            parse_data_cmd(RemainingString(ms))
-        except MessageParsingError:
-            pass
-        except ParameterArgumentParsingError:
-            self._msg_type = Message._DATA
-            self._param_arg_error = True
-            return
-        else:
-            self._msg_type = Message._DATA
+            matched_msg_obj = match_encoded_client_msg(ms)
+            if matched_msg_obj is not None:
+                path = matched_msg_obj[1].decode() if matched_msg_obj.lastindex else None
+            else:
+                path = parsing_procedure(RemainingString(ms.decode()))
+        # (a message that is not valid UTF-8 is not recognized either)
+        except (MessageParsingError, UnicodeDecodeError):
+            self._msg_type = Message._UNRECOGNIZED
             self._param_arg_error = False
-            return
-
-        # Attempt init as QUIT command
-        try:
-            parse_quit_cmd(RemainingString(ms))
-        except MessageParsingError:
-            pass
         except ParameterArgumentParsingError:
-            self._msg_type = Message._QUIT
+            self._msg_type = msg_type
             self._param_arg_error = True
-            return
         else:
-            self._msg_type = Message._QUIT
+            self._msg_type = msg_type
             self._param_arg_error = False
-            return
-
-        # If not a MAIL_FROM, RCPT_TO, DATA, or QUIT command, init as UNRECOGNIZED
-        self._msg_type = Message._UNRECOGNIZED
-        self._param_arg_error = False # If an unrecognized command, defaults to no ParameterArgumentParsingError
+            self._path = path
 
     def is_recognized(self):
         return self._msg_type != Message._UNRECOGNIZED
@@ -112,3 +81,8 @@ class Message:
 
     def has_valid_params_args(self):
         return not self._param_arg_error
+
+    def get_path(self):
+        """Returns the path (<...>) carried by a 'MAIL FROM' or 'RCPT TO' command with valid parameters
+        and arguments, or None for any other message."""
+        return self._path
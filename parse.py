@@ -52,59 +52,102 @@ unparsed portion of an original string.
 import re
 from exceptions import *
 
-class RemainingString:
-    """Wrapper class for the unparsed portion of a string."""
+# Compiled patterns consumed by the parsing functions
+# Message keywords
+_RE_HELO = re.compile("HELO")
+_RE_MAIL = re.compile("MAIL")
+_RE_FROM = re.compile("FROM:")
+_RE_RCPT = re.compile("RCPT")
+_RE_TO = re.compile("TO:")
+_RE_DATA = re.compile("DATA")
+_RE_QUIT = re.compile("QUIT")
+# Response codes
+_RE_220 = re.compile("220")
+_RE_221 = re.compile("221")
+_RE_250 = re.compile("250")
+_RE_354 = re.compile("354")
+# Punctuation
+_RE_LT = re.compile("<")
+_RE_GT = re.compile(">")
+_RE_AT = re.compile("@")
+_RE_COMMA = re.compile(",")
+# Production rules
+_RE_WHITESPACE = re.compile("[ \t]+")
+_RE_NULLSPACE = re.compile("[ \t]*")
+_RE_CRLF = re.compile("\n")
+_RE_STRING = re.compile("[^<>()[\\]\\\\.,;:@\" \t\n]+")
+_RE_DOMAIN = re.compile("([A-Za-z][A-Za-z0-9]*)(\\.([A-Za-z][A-Za-z0-9]*))*")
+_RE_ARBITRARY_TEXT = re.compile("[ -~]+")
+
+# Characters which, following a "HELO", "DATA", or "QUIT" keyword, indicate that the message has
+# been recognized (along with no character at all)
+_LOOKAHEAD_OK = frozenset(" \t\n")
+
+# Translation table mapping each byte that cannot occur in a <string> (a <special>, <SP>, or newline)
+# to 1 and every other byte to 0, used to find the end of an ASCII <string> in a single C-level scan
+_STRING_STOP_TABLE = bytes(1 if chr(byte) in "<>()[]\\.,;:@\" \t\n" else 0 for byte in range(256))
+
+# Compiled patterns equivalent to the <xxx-resp-code-msg> production rules, keyed by response code
+# (as the parsing functions do not backtrack, the <arbitrary-text> begins only after all of the
+# <whitespace>, and so with a non-space character)
+_RE_RESP_CODE_MSGS = {resp_code: re.compile(resp_code + "[ \t]+[!-~][ -~]*\n")
+                      for resp_code in ("220", "221", "250", "354")}
+
+# Compiled patterns each matching an entire well-formed client message in a single pass, equivalent
+# to the message's production rule. Each repetition is followed by a character it cannot match, so
+# no match depends on backtracking (which the parsing functions lack); the one exception, the
+# trailing <nullspace> of a "HELO" message, is written to begin with a tab (a space would have been
+# consumed by the <arbitrary-text>)
+_PATH_PATTERN = "<[^<>()[\\]\\\\.,;:@\" \t\n]+@[A-Za-z][A-Za-z0-9]*(?:\\.[A-Za-z][A-Za-z0-9]*)*>"
+_RE_HELO_MSG = re.compile("HELO[ \t]+[!-~][ -~]*(?:\t[ \t]*)?\n")
+_RE_MAIL_FROM_CMD = re.compile("MAIL[ \t]+FROM:[ \t]*(" + _PATH_PATTERN + ")[ \t]*\n")
+_RE_RCPT_TO_CMD = re.compile("RCPT[ \t]+TO:[ \t]*(" + _PATH_PATTERN + ")[ \t]*\n")
+_RE_DATA_CMD = re.compile("DATA[ \t]*\n")
+_RE_QUIT_CMD = re.compile("QUIT[ \t]*\n")
+
+# Encoded counterparts of the patterns above (which are pure ASCII, and so match an encoded well-formed
+# message exactly when they match the decoded one), keyed by the message's leading 4-byte verb
+_RE_ENCODED_CLIENT_MSGS = {pattern.pattern[:4].encode(): re.compile(pattern.pattern.encode())
+                           for pattern in (_RE_HELO_MSG, _RE_MAIL_FROM_CMD, _RE_RCPT_TO_CMD,
+                                           _RE_DATA_CMD, _RE_QUIT_CMD)}
 
-    def __init__(self, initial_string):
-        self._remaining_string = initial_string
+class RemainingString:
+    """Wrapper class for the unparsed portion of a string. The unparsed portion is tracked as a
+    position within the underlying string (rather than as a copy of the string's tail), so that
+    consuming from it does not require allocating a new string. The parsing functions of this
+    module access _buf and _pos directly."""
 
-    def get(self):
-        return self._remaining_string
+    __slots__ = ("_buf", "_pos", "_string_stop_map")
 
-    def set(self, remaining_string):
-        self._remaining_string = remaining_string
+    def __init__(self, initial_string):
+        self._buf = initial_string
+        self._pos = 0
+        # The underlying string translated through _STRING_STOP_TABLE (b"" if it is not ASCII),
+        # computed on first use by _scan_string
+        self._string_stop_map = None
 
     def is_empty(self):
-        return not bool(self._remaining_string)
-
-    def get_first_char(self):
-        if self.is_empty():
-            return ""
-        return self._remaining_string[0]
+        return self._pos >= len(self._buf)
 
     def has_further_chars(self):
-        return True if self._remaining_string else False
-
-    def append(self, string_to_append):
-        self._remaining_string = self._remaining_string + string_to_append
-
-    def contains_complete_msg(self):
-        """Returns as a Bool whether the current _remaining_string contains a candidate
-        SMTP message substring (a substring ending in a newline)."""
-        return True if re.match(".*?\n", self._remaining_string) is not None else False
-
-    def consume_and_get_msg(self):
-        """Consumes from the current _remaining_string and returns the first (and shortest)
-        candidate SMTP message substring in the current _remaining_string."""
-        msg_str = re.match(".*?\n", self._remaining_string)[0]
-        consume(".*?\n", self)
-        return msg_str
+        return self._pos < len(self._buf)
 
 def parse_helo_msg(rs):
     """
     <helo-msg> ::= "HELO" <whitespace> <arbitrary-text> <nullspace> <CRLF>
     """
-    try:
-        consume("HELO", rs)
-    except ConsumptionError:
+    # Match a well-formed message in a single pass, falling back to the production rules below
+    # (to raise the appropriate ParsingError) only on a mismatch
+    if consume(_RE_HELO_MSG, rs):
+        return
+    if consume(_RE_HELO, rs) is None:
         raise MessageParsingError("helo-msg")
     # Here, one-character-look-ahead is used to discern what type of ParsingError should be raised if one occurs:
     #   In the case that no character, a space character, a tab character, or a newline character
     #   follows, a "HELO" message has been recognized and a ParameterArgumentParsingError should
     #   be raised on a subsequent parsing error. Otherwise, a "HELO" message has not been recognized,
     #   and a MessageParsingError will be raised.
-    if (rs.is_empty() or rs.get_first_char() == " "
-            or rs.get_first_char() == "\t" or rs.get_first_char() == "\n"):
+    if rs.is_empty() or rs._buf[rs._pos] in _LOOKAHEAD_OK:
         try:
             parse_whitespace(rs)
             parse_arbitrary_text(rs)
@@ -120,61 +163,80 @@ def parse_mail_from_cmd(rs):
     """
     <mail-from-cmd> ::= “MAIL” <whitespace> “FROM:” <nullspace> <reverse-path>
                          <nullspace> <CRLF>
-    """
+    Returns the <reverse-path> parsed.
+    """
+    # Match a well-formed message in a single pass, falling back to the production rules below
+    # (to raise the appropriate ParsingError) only on a mismatch
+    matched_string_obj = consume(_RE_MAIL_FROM_CMD, rs)
+    if matched_string_obj is not None:
+        return matched_string_obj[1]
+    if consume(_RE_MAIL, rs) is None:
+        raise MessageParsingError("mail-from-cmd")
     try:
-        consume("MAIL", rs)
         parse_whitespace(rs)
-        consume("FROM:", rs)
-    except ConsumptionError:
-        raise MessageParsingError("mail-from-cmd")
     except ParsingError as e:
         raise MessageParsingError(str(e))
+    if consume(_RE_FROM, rs) is None:
+        raise MessageParsingError("mail-from-cmd")
     try:
         parse_nullspace(rs)
+        path_start = rs._pos
         parse_reverse_path(rs)
+        path_end = rs._pos
         parse_nullspace(rs)
         parse_CRLF(rs)
     except ParsingError as e:
         raise ParameterArgumentParsingError(str(e))
+    return rs._buf[path_start:path_end]
 
 
 def parse_rcpt_to_cmd(rs):
     """
     <rcpt-to-cmd> ::= “RCPT” <whitespace> “TO:” <nullspace> <forward-path>
                       <nullspace> <CRLF>
-    """
+    Returns the <forward-path> parsed.
+    """
+    # Match a well-formed message in a single pass, falling back to the production rules below
+    # (to raise the appropriate ParsingError) only on a mismatch
+    matched_string_obj = consume(_RE_RCPT_TO_CMD, rs)
+    if matched_string_obj is not None:
+        return matched_string_obj[1]
+    if consume(_RE_RCPT, rs) is None:
+        raise MessageParsingError("rcpt-to-cmd")
     try:
-        consume("RCPT", rs)
         parse_whitespace(rs)
-        consume("TO:", rs)
-    except ConsumptionError:
-        raise MessageParsingError("rcpt-to-cmd")
     except ParsingError as e:
         raise MessageParsingError(str(e))
+    if consume(_RE_TO, rs) is None:
+        raise MessageParsingError("rcpt-to-cmd")
     try:
         parse_nullspace(rs)
+        path_start = rs._pos
         parse_forward_path(rs)
+        path_end = rs._pos
         parse_nullspace(rs)
         parse_CRLF(rs)
     except ParsingError as e:
         raise ParameterArgumentParsingError(str(e))
+    return rs._buf[path_start:path_end]
 
 
 def parse_data_cmd(rs):
     """
     <data-cmd> ::= “DATA” <nullspace> <CRLF>
     """
-    try:
-        consume("DATA", rs)
-    except ConsumptionError:
+    # Match a well-formed message in a single pass, falling back to the production rules below
+    # (to raise the appropriate ParsingError) only on a mismatch
+    if consume(_RE_DATA_CMD, rs):
+        return
+    if consume(_RE_DATA, rs) is None:
         raise MessageParsingError("data-cmd")
     # Here, one-character-look-ahead is used to discern what type of ParsingError should be raised if one occurs:
     #   In the case that no character, a space character, a tab character, or a newline character
     #   follows, a "DATA" command message has been recognized and a ParameterArgumentParsingError
     #   should be raised on a subsequent parsing error. Otherwise, a "DATA" command message has not
     #   been recognized, and a MessageParsingError will be raised.
-    if (rs.is_empty() or rs.get_first_char() == " "
-            or rs.get_first_char() == "\t" or rs.get_first_char() == "\n"):
+    if rs.is_empty() or rs._buf[rs._pos] in _LOOKAHEAD_OK:
         try:
             parse_nullspace(rs)
             parse_CRLF(rs)
@@ -188,17 +250,18 @@ def parse_quit_cmd(rs):
     """
     <quit-cmd> ::= “QUIT” <nullspace> <CRLF>
     """
-    try:
-        consume("QUIT", rs)
-    except ConsumptionError:
+    # Match a well-formed message in a single pass, falling back to the production rules below
+    # (to raise the appropriate ParsingError) only on a mismatch
+    if consume(_RE_QUIT_CMD, rs):
+        return
+    if consume(_RE_QUIT, rs) is None:
         raise MessageParsingError("quit-cmd")
     # Here, one-character-look-ahead is used to discern what type of ParsingError should be raised if one occurs:
     #   In the case that no character, a space character, a tab character, or a newline character
     #   follows, a "QUIT" command message has been recognized and a ParameterArgumentParsingError
     #   should be raised on a subsequent parsing error. Otherwise, a "QUIT" command message has not
     #   been recognized, and a MessageParsingError will be raised.
-    if (rs.is_empty() or rs.get_first_char() == " "
-            or rs.get_first_char() == "\t" or rs.get_first_char() == "\n"):
+    if rs.is_empty() or rs._buf[rs._pos] in _LOOKAHEAD_OK:
         try:
             parse_nullspace(rs)
             parse_CRLF(rs)
@@ -208,14 +271,21 @@ def parse_quit_cmd(rs):
         raise MessageParsingError("quit-cmd")
 
 
+def match_encoded_client_msg(msg_bytes):
+    """Matches an entire encoded (UTF-8) client message against the pattern for a well-formed message
+        of the type indicated by its leading 4-byte verb, without decoding it. Returns the match object
+        (whose group 1 is the encoded path, for a 'MAIL FROM' or 'RCPT TO' command), or None if the
+        message is not a well-formed client message."""
+    pattern = _RE_ENCODED_CLIENT_MSGS.get(msg_bytes[:4])
+    return None if pattern is None else pattern.match(msg_bytes)
+
+
 def parse_whitespace(rs):
     """
     <whitespace> ::= <SP> | <SP> <whitespace>
             <SP> ::= the space or tab character
     """
-    try:
-        consume("[ \t]+", rs)
-    except ConsumptionError:
+    if consume(_RE_WHITESPACE, rs) is None:
         raise ParsingError("whitespace")
 
 
@@ -226,9 +296,7 @@ def parse_nullspace(rs):
     <whitespace> ::= <SP> | <SP> <whitespace>
             <SP> ::= the space or tab character
     """
-    try:
-        consume("[ \t]*", rs)
-    except ConsumptionError:
+    if consume(_RE_NULLSPACE, rs) is None:
         raise ParsingError("nullspace")
 
 
@@ -250,9 +318,7 @@ def parse_CRLF(rs):
     """
     <CRLF> ::= the newline character
     """
-    try:
-        consume("\n", rs)
-    except ConsumptionError:
+    if consume(_RE_CRLF, rs) is None:
         raise ParsingError("CRLF")
 
 
@@ -260,14 +326,10 @@ def parse_path(rs):
     """
     <path> ::= "<" <mailbox> ">"
     """
-    try:
-        consume("<", rs)
-    except ConsumptionError:
+    if consume(_RE_LT, rs) is None:
         raise ParsingError("path")
     parse_mailbox(rs)
-    try:
-        consume(">", rs)
-    except ConsumptionError:
+    if consume(_RE_GT, rs) is None:
         raise ParsingError("path")
 
 
@@ -276,9 +338,7 @@ def parse_mailbox(rs):
     <mailbox> ::= <local-part> "@" <domain>
     """
     parse_local_part(rs)
-    try:
-        consume("@", rs)
-    except ConsumptionError:
+    if consume(_RE_AT, rs) is None:
         raise ParsingError("mailbox")
     parse_domain(rs)
 
@@ -301,9 +361,7 @@ def parse_domain(rs):
         <let-dig> ::= <letter> | <digit>
           <digit> ::= any one of the ten digits 0 through 9
     """
-    try:
-        consume("([A-Za-z][A-Za-z0-9]*)(\\.([A-Za-z][A-Za-z0-9]*))*", rs)
-    except ConsumptionError:
+    if consume(_RE_DOMAIN, rs) is None:
         raise ParsingError("domain")
 
 
@@ -316,19 +374,17 @@ def parse_string(rs):
                   | "," | ";" | ":" | "@" | '"'
          <SP> ::= the space or tab character
     """
-    try:
-        consume("[^<>()[\\]\\\\.,;:@\" \t\n]+", rs)
-    except ConsumptionError:
+    pos = _scan_string(rs, rs._pos)
+    if pos < 0:
         raise ParsingError("string")
+    rs._pos = pos
 
 
 def parse_220_resp_code_msg(rs):
     """
     <220-resp-code-msg> ::= "220" <whitespace> <arbitrary-text> <CRLF>
     """
-    try:
-        consume("220", rs)
-    except ConsumptionError:
+    if consume(_RE_220, rs) is None:
         raise ParsingError("server-greeting")
     parse_whitespace(rs)
     parse_arbitrary_text(rs)
@@ -339,9 +395,7 @@ def parse_221_resp_code_msg(rs):
     """
     <221-resp-code-msg> ::= "221" <whitespace> <arbitrary-text> <CRLF>
     """
-    try:
-        consume("221", rs)
-    except ConsumptionError:
+    if consume(_RE_221, rs) is None:
         raise ParsingError("250-resp-code-msg")
     parse_whitespace(rs)
     parse_arbitrary_text(rs)
@@ -351,9 +405,7 @@ def parse_250_resp_code_msg(rs):
     """
     <250-resp-code-msg> ::= "250" <whitespace> <arbitrary-text> <CRLF>
     """
-    try:
-        consume("250", rs)
-    except ConsumptionError:
+    if consume(_RE_250, rs) is None:
         raise ParsingError("250-resp-code-msg")
     parse_whitespace(rs)
     parse_arbitrary_text(rs)
@@ -364,22 +416,29 @@ def parse_354_resp_code_msg(rs):
     """
     <354-resp-code-msg> ::= "354" <whitespace> <arbitrary-text> <CRLF>
     """
-    try:
-        consume("354", rs)
-    except ConsumptionError:
+    if consume(_RE_354, rs) is None:
         raise ParsingError("250-resp-code-msg")
     parse_whitespace(rs)
     parse_arbitrary_text(rs)
     parse_CRLF(rs)
 
 
+def parse_resp_code_msg_fast(msg_str, expected_code):
+    """Validates that the provided line of a server response is either a <xxx-resp-code-msg> for
+        the expected response code (e.g. "250") or, for all but the last line of a multiline
+        response, a continuation line (the expected response code followed by a "-"). Operates
+        directly on the string (no RemainingString required) and raises a ParsingError on failure."""
+    if len(msg_str) < 4 or msg_str[:3] != expected_code or msg_str[3] not in " \t-":
+        raise ParsingError(expected_code + "-resp-code-msg")
+    if msg_str[3] != "-" and _RE_RESP_CODE_MSGS[expected_code].match(msg_str) is None:
+        raise ParsingError(expected_code + "-resp-code-msg")
+
+
 def parse_arbitrary_text(rs):
     """
     <arbitrary-text> ::= any sequence of one or more printable characters
     """
-    try:
-        consume("[ -~]+", rs)
-    except ConsumptionError:
+    if consume(_RE_ARBITRARY_TEXT, rs) is None:
         raise ParsingError("arbitrary-text")
 
 
@@ -391,18 +450,81 @@ def parse_comma_sep_mailboxes(rs):
         parse_mailbox(rs)
         if rs.is_empty():
             break
-        try:
-            consume(",", rs)
-        except ConsumptionError:
+        if consume(_RE_COMMA, rs) is None:
             raise ParsingError("comma-sep-mailboxes")
         parse_nullspace(rs)
 
 
-def consume(regexp, rs):
-    """Attempts to match the provided regexp pattern with the beginning of the remaining message string.
-        If there is a match, the matching portion of the remaining message string is removed (consumed).
-        Otherwise, a ConsumptionError is raised."""
-    matched_string_obj = re.match(regexp, rs.get())
-    if matched_string_obj is None:
-        raise ConsumptionError()
-    rs.set(rs.get()[len(matched_string_obj[0]):])
+def parse_mailbox_nothrow(rs):
+    """
+    <mailbox> ::= <local-part> "@" <domain>
+    Non-raising counterpart of parse_mailbox: returns None if a <mailbox> was parsed (and consumed),
+    or otherwise the name of the non-terminal with which parse_mailbox's ParsingError would have
+    been raised.
+    """
+    pos = _scan_string(rs, rs._pos)
+    if pos < 0:
+        return "string"
+    if rs._buf[pos:pos + 1] != "@":
+        return "mailbox"
+    pos = _scan_domain(rs._buf, pos + 1)
+    if pos < 0:
+        return "domain"
+    rs._pos = pos
+    return None
+
+
+def parse_comma_sep_mailboxes_nothrow(rs):
+    """
+    <comma-sep-mailboxes> ::= <mailbox> | <mailbox> "," <nullspace> <comma-sep-mailboxes>
+    Non-raising counterpart of parse_comma_sep_mailboxes: returns None if a <comma-sep-mailboxes>
+    was parsed (and consumed), or otherwise the name of the non-terminal with which
+    parse_comma_sep_mailboxes's ParsingError would have been raised.
+    """
+    while True:
+        error_name = parse_mailbox_nothrow(rs)
+        if error_name is not None:
+            return error_name
+        if rs.is_empty():
+            return None
+        if not rs._buf.startswith(",", rs._pos):
+            return "comma-sep-mailboxes"
+        rs._pos += 1
+        consume(_RE_NULLSPACE, rs)
+
+
+def _scan_string(rs, pos):
+    """Leaf scanner for the <string> production rule: returns the index just past the <string>
+        beginning at index pos of the remaining string rs's underlying string, or -1 if no <string>
+        begins there. In an ASCII string, <string>s are found with a find over the string's
+        translation through _STRING_STOP_TABLE, computed once per RemainingString (so that each
+        <string> costs a scan of the <string> alone)."""
+    string_stop_map = rs._string_stop_map
+    if string_stop_map is None:
+        string_stop_map = rs._string_stop_map = (rs._buf.encode("ascii").translate(_STRING_STOP_TABLE)
+                                                 if rs._buf.isascii() else b"")
+    if not string_stop_map:
+        matched_string_obj = _RE_STRING.match(rs._buf, pos)
+        return -1 if matched_string_obj is None else matched_string_obj.end()
+    end = string_stop_map.find(b"\x01", pos)
+    if end < 0:
+        end = len(string_stop_map)
+    return -1 if end == pos else end
+
+
+def _scan_domain(buf, pos):
+    """Leaf scanner for the <domain> production rule: returns the index just past the <domain>
+        beginning at index pos of buf, or -1 if no <domain> begins there."""
+    matched_string_obj = _RE_DOMAIN.match(buf, pos)
+    return -1 if matched_string_obj is None else matched_string_obj.end()
+
+
+def consume(pattern, rs):
+    """Attempts to match the provided compiled regexp pattern with the beginning of the remaining message
+        string. If there is a match, the matching portion of the remaining message string is removed
+        (consumed) and the match object is returned. Otherwise, None is returned (and nothing is
+        consumed)."""
+    matched_string_obj = pattern.match(rs._buf, rs._pos)
+    if matched_string_obj is not None:
+        rs._pos = matched_string_obj.end()
+    return matched_string_obj
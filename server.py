@@ -2,14 +2,48 @@
 SMTP Mail Server
 """
 
-import re
 import sys
-from socket import socket, AF_INET, SOCK_STREAM, getfqdn, gethostname
+import time
+from threading import Thread, BoundedSemaphore
+from socket import socket, AF_INET, SOCK_STREAM, IPPROTO_TCP, TCP_NODELAY, getfqdn, gethostname
 from email import Email
 from message import Message
-from parse import RemainingString
 from exceptions import *
 
+########################## Message Strings & More ##########################
+# "220 <server hostname + domain name>" greeting message
+GREETING_220_MSG = ("220 " + getfqdn() + "\n").encode()
+# "221 <server hostname> closing connection" message
+CLOS_CON_221_MSG = ("221 " + gethostname() + " closing connection\n").encode()
+# "250 Hello <client domain name> pleased to meet you" acknowledgement messsage start and end
+HELO_ACK_250_MSG_START, HELO_ACK_250_MSG_END = b"250 Hello ", b" pleased to meet you\n"
+# "250 OK" message
+OK_250_MSG = ("250 OK\n").encode()
+# "354 Start mail input; end with <CRLF>.<CRLF>\n" message
+START_MAIL_354_MSG = ("354 Start mail input; end with <CRLF>.<CRLF>\n").encode()
+# "500 Syntax error: command unrecognized" error message
+SYN_COM_UNREC_ERR_500_MSG = ("500 Syntax error: command unrecognized\n").encode()
+# "501 Syntax error in parametrs or arguments" error message
+SYN_PARAM_ARG_ERR_501_MSG = ("501 Syntax error in parameters or arguments\n").encode()
+# "503 Bad sequence of commands" error message
+BAD_SEQ_COM_ERR_503_MSG  = ("503 Bad sequence of commands\n").encode()
+# End-of-message-data sequence - <CRLF>.<CRLF>
+# (used at / checked against the beginning of a new line)
+EOMD_SEQ = b".\n"
+# Maximum number of client connections served at once
+MAX_CONNECTIONS = 128
+###############################################################################
+
+########################## States ##########################
+# The states in which the state machine expects:
+STATE_0 = 0 # a 'HELO' message (continues to STATE_1)
+STATE_1 = 1 # a 'MAIL FROM' command (continues to STATE_2)
+STATE_2 = 2 # a 'RCPT TO' command (continues to STATE_3)
+STATE_3 = 3 # either a 'RCPT TO' command (remains at STATE_3) or a 'DATA' command (continues to STATE_4)
+STATE_4 = 4 # either a message data line (remains at STATE_4) or an end-of-message-data sequence (continues to STATE_1)
+# NOTE: a 'QUIT' command is valid in any state
+#############################################################
+
 def SMTP_server_engine():
     """Engine for a SMTP mail server process.
     This engine is primarily implemented as a state machine with five states: STATE_0, STATE_1, STATE_2,
@@ -20,40 +54,10 @@ def SMTP_server_engine():
     at STATE_3) or a 'DATA' command (continues to STATE_4). In STATE_4, the state machine expects either a
     message data line (remains at STATE_4) or an end-of-message-data sequence (continues to STATE_1). In
     addition, the state machine will accept and handle a valid 'QUIT' command in any one of its states.
+    Each client connection is served by its own thread (see serve_connection), with its own state machine,
+    with at most MAX_CONNECTIONS connections being served at once.
     """
 
-    ########################## States ##########################
-    # The states in which the state machine expects:
-    STATE_0 = 0 # a 'HELO' message (continues to STATE_1)
-    STATE_1 = 1 # a 'MAIL FROM' command (continues to STATE_2)
-    STATE_2 = 2 # a 'RCPT TO' command (continues to STATE_3)
-    STATE_3 = 3 # either a 'RCPT TO' command (remains at STATE_3) or a 'DATA' command (continues to STATE_4)
-    STATE_4 = 4 # either a message data line (remains at STATE_4) or an end-of-message-data sequence (continues to STATE_1)
-    # NOTE: a 'QUIT' command is valid in any state
-    #############################################################
-
-    ########################## Message Strings & More ##########################
-    # "220 <server hostname + domain name>" greeting message
-    GREETING_220_MSG = ("220 " + getfqdn() + "\n").encode()
-    # "221 <server hostname> closing connection" message
-    CLOS_CON_221_MSG = ("221 " + gethostname() + " closing connection\n").encode()
-    # "250 Hello <client domain name> pleased to meet you" acknowledgement messsage start and end (unencoded)
-    HELO_ACK_250_MSG_START_UNENC, HELO_ACK_250_MSG_END_UNENC = "250 Hello ", " pleased to meet you\n"
-    # "250 OK" message
-    OK_250_MSG = ("250 OK\n").encode()
-    # "354 Start mail input; end with <CRLF>.<CRLF>\n" message
-    START_MAIL_354_MSG = ("354 Start mail input; end with <CRLF>.<CRLF>\n").encode()
-    # "500 Syntax error: command unrecognized" error message
-    SYN_COM_UNREC_ERR_500_MSG = ("500 Syntax error: command unrecognized\n").encode()
-    # "501 Syntax error in parametrs or arguments" error message
-    SYN_PARAM_ARG_ERR_501_MSG = ("501 Syntax error in parameters or arguments\n").encode()
-    # "503 Bad sequence of commands" error message
-    BAD_SEQ_COM_ERR_503_MSG  = ("503 Bad sequence of commands\n").encode()
-    # End-of-message-data sequence - <CRLF>.<CRLF>
-    # (used at / checked against the beginning of a new line)
-    EOMD_SEQ = ".\n"
-    ###############################################################################
-
     ############################## Main Server Mechanism ##############################
 
     # Create welcoming socket, bind command-line-argument-specified
@@ -62,7 +66,7 @@ def SMTP_server_engine():
         welcome_port_number = int(sys.argv[1])
         welcoming_socket = socket(AF_INET, SOCK_STREAM)
         welcoming_socket.bind(('', welcome_port_number))
-        welcoming_socket.listen(1)
+        welcoming_socket.listen(128)
     # Alert and terminate on error
     except Exception as e:
         print("Error initializing welcoming socket. "
@@ -70,199 +74,268 @@ def SMTP_server_engine():
                 + str(e))
         return
 
+    # Slots for the connections being served (once all are taken, further connection
+    # requests wait in the welcoming socket's queue until a connection has been served)
+    connection_slots = BoundedSemaphore(MAX_CONNECTIONS)
+
     while True:
 
+        # Await a free connection slot
+        connection_slots.acquire()
+
         # Await connection at welcoming socket and create connection socket on connection
         try:
             connection_socket, client_address = welcoming_socket.accept()
+            # Send the (small) response messages immediately, rather than letting Nagle's
+            # algorithm hold them back awaiting the client's acknowledgement of earlier ones
+            connection_socket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
         # Alert and await new connection on error
         except Exception as e:
+            connection_slots.release()
             print("Error establishing connection with client. "
                     "Awaiting new connection. "
                     "Exception encountered: "
                     + str(e))
             continue
 
-        # Send 220 "greeting" message
+        # Serve the connection on its own thread, so that other clients' connections
+        # can be accepted and served concurrently
         try:
-            send_msg(GREETING_220_MSG, connection_socket)
-        # Await new connection on error
-        # (having already closed connection and alerted user)
-        except SocketError:
-            continue
+            Thread(target=serve_connection_in_slot,
+                    args=(connection_socket, client_address, connection_slots),
+                    daemon=True).start()
+        # Alert, close connection, and await new connection on error
+        except Exception as e:
+            connection_socket.close()
+            connection_slots.release()
+            print("Error starting thread to serve client connection. "
+                    "Closing connection and awaiting new connection. "
+                    "Exception encountered: "
+                    + str(e))
+
+  ###################################################################################
+
+def serve_connection_in_slot(connection_socket, client_address, connection_slots):
+    """Serves a single client connection (see serve_connection), then releases the connection slot
+    it was served in."""
+    try:
+        serve_connection(connection_socket, client_address)
+    finally:
+        connection_slots.release()
+
+def serve_connection(connection_socket, client_address):
+    """Serves a single client connection: sends the 220 greeting message, then runs the state
+    machine (see SMTP_server_engine) over the client messages received through the connection
+    socket until the client quits, the connection is closed, or an error is encountered."""
 
-        # Initiate state machine, receiving and sending messages through connection socket:
+    # Send 220 "greeting" message
+    try:
+        send_msg(GREETING_220_MSG, connection_socket)
+    # Stop serving the connection on error
+    # (having already closed connection and alerted user)
+    except SocketError:
+        return
+
+    # Initiate state machine, receiving and sending messages through connection socket:
+
+    state = STATE_0
+    current_email = Email()
+    # Bytes received through the connection socket not yet obtained as a complete client SMTP message
+    sock_stream_buffer = bytearray()
+    # Index in the buffer from which to search for the end of the next message
+    # (the bytes before it having already been searched)
+    msg_end_search_start = 0
 
-        state = STATE_0
-        current_email = Email()
-        sock_stream_rem_string = RemainingString("")
+    # Forward files opened (lazily) while serving the connection, keyed by forward file name
+    forward_files = {}
 
+    try:
         while True:
 
             try:
 
                 # If necessary, draw from socket stream to obtain a complete client SMTP message
-                if not sock_stream_rem_string.contains_complete_msg():
-                    sock_stream_rem_string.append(recv_msg(connection_socket, state).decode())
+                # (a line ending in a newline), which is handled without being decoded
+                msg_end = sock_stream_buffer.find(b"\n", msg_end_search_start)
+                if msg_end < 0:
+                    msg_end_search_start = len(sock_stream_buffer)
+                    received_bytes = recv_msg(connection_socket, state)
+                    # Stop serving the connection if the client has closed it
+                    if not received_bytes:
+                        connection_socket.close()
+                        break
+                    sock_stream_buffer += received_bytes
                     continue
                 else:
-                    msg_str = sock_stream_rem_string.consume_and_get_msg()
+                    msg_bytes = bytes(sock_stream_buffer[:msg_end + 1])
+                    del sock_stream_buffer[:msg_end + 1]
+                    msg_end_search_start = 0
 
                 # Gather email data from client message, store email data when applicable,
                 # update state machine state as appropriate, and send relevant response
                 # messages (all based on the current state of the state machine)
-                if state == STATE_0:
-
-                    msg = Message(msg_str)
-
-                    if not msg.is_recognized():
-                        send_msg(SYN_COM_UNREC_ERR_500_MSG, connection_socket)
-                        continue
-                    elif not msg.is_helo_msg():
-                        if msg.is_quit_cmd():
-                            if msg.has_valid_params_args():
-                                send_msg(CLOS_CON_221_MSG, connection_socket)
-                                connection_socket.close()
-                                break
-                            else:
-                                send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
-                                continue
-                        else:
-                            send_msg(BAD_SEQ_COM_ERR_503_MSG, connection_socket)
-                            continue
-                    elif not msg.has_valid_params_args():
-                        send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
-                        continue
-                    else:
-                        send_msg((HELO_ACK_250_MSG_START_UNENC
-                            + client_address[0]
-                            + HELO_ACK_250_MSG_END_UNENC).encode(),
-                            connection_socket)
-                        state = STATE_1
-                        continue
-
-                elif state == STATE_1:
-
-                    msg = Message(msg_str)
-
-                    if not msg.is_recognized():
-                        send_msg(SYN_COM_UNREC_ERR_500_MSG, connection_socket)
-                        continue
-                    elif not msg.is_mail_from_cmd():
-                        if msg.is_quit_cmd():
-                            if msg.has_valid_params_args():
-                                send_msg(CLOS_CON_221_MSG, connection_socket)
-                                connection_socket.close()
-                                break
-                            else:
-                                send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
-                                continue
-                        else:
-                            send_msg(BAD_SEQ_COM_ERR_503_MSG, connection_socket)
-                            continue
-                    elif not msg.has_valid_params_args():
-                        send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
-                        continue
-                    else:
-                        current_email.set_reverse_path(re.search("<.*>", msg_str)[0])
-                        send_msg(OK_250_MSG, connection_socket)
-                        state = STATE_2
-                        continue
-
-                elif state == STATE_2:
-
-                    msg = Message(msg_str)
-
-                    if not msg.is_recognized():
-                        send_msg(SYN_COM_UNREC_ERR_500_MSG, connection_socket)
-                        continue
-                    elif not msg.is_rcpt_to_cmd():
-                        if msg.is_quit_cmd():
-                            if msg.has_valid_params_args():
-                                send_msg(CLOS_CON_221_MSG, connection_socket)
-                                connection_socket.close()
-                                break
-                            else:
-                                send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
-                                continue
-                        else:
-                            send_msg(BAD_SEQ_COM_ERR_503_MSG, connection_socket)
-                            continue
-                    elif not msg.has_valid_params_args():
-                        send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
-                        continue
-                    else:
-                        current_email.add_forward_path(re.search("<.*>", msg_str)[0])
-                        send_msg(OK_250_MSG, connection_socket)
-                        state = STATE_3
-                        continue
-
-                elif state == STATE_3:
-
-                    msg = Message(msg_str)
-
-                    if not msg.is_recognized():
-                        send_msg(SYN_COM_UNREC_ERR_500_MSG, connection_socket)
-                        continue
-                    elif msg.is_quit_cmd():
-                        if msg.has_valid_params_args():
-                            send_msg(CLOS_CON_221_MSG, connection_socket)
-                            connection_socket.close()
-                            break
-                        else:
-                            send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
-                            continue
-                    elif msg.is_rcpt_to_cmd():
-                        if not msg.has_valid_params_args():
-                            send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
-                            continue
-                        else:
-                            current_email.add_forward_path(re.search("<.*>", msg_str)[0])
-                            send_msg(OK_250_MSG, connection_socket)
-                            continue
-                    elif msg.is_data_cmd():
-                        if not msg.has_valid_params_args():
-                            send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
-                            continue
-                        else:
-                            send_msg(START_MAIL_354_MSG, connection_socket)
-                            state = STATE_4
-                            continue
-                    else:
-                        send_msg(BAD_SEQ_COM_ERR_503_MSG, connection_socket)
-                        continue
-
-                elif state == STATE_4:
-
-                    if msg_str == EOMD_SEQ:
-                        for ff_name in current_email.domain_specific_forward_file_names():
-                            with open("forward/" + ff_name, 'a+') as forward_file:
-                                for line in current_email.forward_file_ready_text_lines():
-                                    forward_file.write(line)
-                        send_msg(OK_250_MSG, connection_socket)
-                        current_email = Email()
-                        state = STATE_1
-                        continue
-                    else:
-                        current_email.add_message_line(msg_str)
-                        continue
-
-            # If a SocketError is encountered, await new connection and reset state machine
+                next_state, should_break = HANDLERS[state](msg_bytes, current_email, connection_socket,
+                                                           client_address, forward_files)
+                if should_break:
+                    break
+                # A completed mail transaction (STATE_4 -> STATE_1) starts a new email
+                if state == STATE_4 and next_state == STATE_1:
+                    current_email.reset()
+                state = next_state
+
+            # If a SocketError is encountered, stop serving the connection
             # (having already closed connection and alerted user)
             except SocketError:
                 break
 
-  ###################################################################################
+    # Alert and stop serving the connection on any other error
+    except Exception as e:
+        print("Error serving client connection. Closing connection and awaiting new connection. "
+                "Exception encountered: " + str(e))
+
+    # Close the forward files and the connection socket (if not already closed)
+    # once the connection has been served
+    finally:
+        for forward_file in forward_files.values():
+            forward_file.close()
+        connection_socket.close()
+
+############################## State handlers ##############################
+# Each handler processes a client message received in its state, given the encoded message, the
+# current email, the connection socket, the client address, and the connection's open forward files,
+# and returns a (next state, whether the connection has been closed) pair. SocketErrors raised while
+# sending are propagated.
+
+def handle_unexpected_msg(msg, state, connection_socket):
+    """Handles a client message that is not one of the messages expected in the given state: an
+    unrecognized message is answered with a 500 error, a valid 'QUIT' command closes the connection,
+    a 'QUIT' command with bad parameters/arguments is answered with a 501 error, and any other
+    message is answered with a 503 error."""
+    if not msg.is_recognized():
+        send_msg(SYN_COM_UNREC_ERR_500_MSG, connection_socket)
+    elif msg.is_quit_cmd():
+        if msg.has_valid_params_args():
+            send_msg(CLOS_CON_221_MSG, connection_socket)
+            connection_socket.close()
+            return state, True
+        send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
+    else:
+        send_msg(BAD_SEQ_COM_ERR_503_MSG, connection_socket)
+    return state, False
+
+def handle_state_0(msg_bytes, current_email, connection_socket, client_address, forward_files):
+    """STATE_0 handler: expects a 'HELO' message."""
+    msg = classify_msg(msg_bytes)
+    if not msg.is_helo_msg():
+        return handle_unexpected_msg(msg, STATE_0, connection_socket)
+    if not msg.has_valid_params_args():
+        send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
+        return STATE_0, False
+    send_msg(b"".join([HELO_ACK_250_MSG_START,
+        client_address[0].encode(),
+        HELO_ACK_250_MSG_END]),
+        connection_socket)
+    return STATE_1, False
+
+def handle_state_1(msg_bytes, current_email, connection_socket, client_address, forward_files):
+    """STATE_1 handler: expects a 'MAIL FROM' command."""
+    msg = classify_msg(msg_bytes)
+    if not msg.is_mail_from_cmd():
+        return handle_unexpected_msg(msg, STATE_1, connection_socket)
+    if not msg.has_valid_params_args():
+        send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
+        return STATE_1, False
+    current_email.set_reverse_path(msg.get_path())
+    send_msg(OK_250_MSG, connection_socket)
+    return STATE_2, False
+
+def handle_state_2(msg_bytes, current_email, connection_socket, client_address, forward_files):
+    """STATE_2 handler: expects a 'RCPT TO' command."""
+    msg = classify_msg(msg_bytes)
+    if not msg.is_rcpt_to_cmd():
+        return handle_unexpected_msg(msg, STATE_2, connection_socket)
+    if not msg.has_valid_params_args():
+        send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
+        return STATE_2, False
+    current_email.add_forward_path(msg.get_path())
+    send_msg(OK_250_MSG, connection_socket)
+    return STATE_3, False
+
+def handle_state_3(msg_bytes, current_email, connection_socket, client_address, forward_files):
+    """STATE_3 handler: expects either a 'RCPT TO' command or a 'DATA' command."""
+    msg = classify_msg(msg_bytes)
+    if msg.is_rcpt_to_cmd():
+        if not msg.has_valid_params_args():
+            send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
+        else:
+            current_email.add_forward_path(msg.get_path())
+            send_msg(OK_250_MSG, connection_socket)
+        return STATE_3, False
+    if msg.is_data_cmd():
+        if not msg.has_valid_params_args():
+            send_msg(SYN_PARAM_ARG_ERR_501_MSG, connection_socket)
+            return STATE_3, False
+        send_msg(START_MAIL_354_MSG, connection_socket)
+        return STATE_4, False
+    return handle_unexpected_msg(msg, STATE_3, connection_socket)
+
+def handle_state_4(msg_bytes, current_email, connection_socket, client_address, forward_files):
+    """STATE_4 handler: expects either a message data line or an end-of-message-data sequence
+    (on which the email is written to the forward file of each recipient domain)."""
+    if msg_bytes == EOMD_SEQ:
+        # The same encoded email text is appended, in a single write (barring a short write, in which
+        # case the rest is written), to each forward file (each forward file being opened on first use
+        # and kept open for the rest of the connection; unbuffered, so that each email is written out
+        # immediately)
+        forward_file_bytes = current_email.forward_file_ready_bytes()
+        for ff_name in current_email.domain_specific_forward_file_names():
+            forward_file = forward_files.get(ff_name)
+            if forward_file is None:
+                forward_file = forward_files[ff_name] = open("forward/" + ff_name, 'ab', buffering=0)
+            unwritten_bytes = memoryview(forward_file_bytes)
+            while unwritten_bytes:
+                unwritten_bytes = unwritten_bytes[forward_file.write(unwritten_bytes):]
+        send_msg(OK_250_MSG, connection_socket)
+        return STATE_1, False
+    current_email.add_encoded_message_line(msg_bytes)
+    return STATE_4, False
+
+# State handlers, indexed by state
+HANDLERS = (handle_state_0, handle_state_1, handle_state_2, handle_state_3, handle_state_4)
+
+##########################################################################################
 
 ############################## Helper procedures/functions ##############################
 
+# Memoized Message objects for recognized client messages, keyed by encoded message (shared by all
+# connections, as Message objects are never modified), along with the maximum number of memoized
+# messages and the maximum length of a memoized message (a client command line being at most 512
+# bytes), so that unrecognized or overlong lines sent by a client are never retained
+classified_msgs = {}
+CLASSIFIED_MSGS_MAX_COUNT = 256
+CLASSIFIED_MSG_MAX_LEN = 512
+
+def classify_msg(msg_bytes):
+    """Given an encoded client message, returns a Message object for it. Recognized messages are
+    memoized, so that repeated messages, such as 'HELO' messages or 'RCPT TO' commands for the
+    same recipients, are parsed only once."""
+    msg = classified_msgs.get(msg_bytes)
+    if msg is None:
+        msg = Message(msg_bytes)
+        if msg.is_recognized() and len(msg_bytes) <= CLASSIFIED_MSG_MAX_LEN:
+            # Start over once the maximum number of messages has been memoized
+            if len(classified_msgs) >= CLASSIFIED_MSGS_MAX_COUNT:
+                classified_msgs.clear()
+            classified_msgs[msg_bytes] = msg
+    return msg
+
 def send_msg(msg, connection_socket):
     """Given an encoded message and a connection socket, sends the message into the socket.
     If an exception is raised as a result of the sending process, this procedure closes
     the connection socket, prints a descriptive 1-line error message, and raises a
     SocketError."""
     try:
-        connection_socket.send(msg)
+        connection_socket.sendall(msg)
     except Exception:
         connection_socket.close()
         print("Error sending message. Closing connection and awating new connection. "
@@ -275,11 +348,11 @@ def recv_msg(connection_socket, state):
     raised as a result of the receiving process, this function closes the connection
     socket, prints a descriptive 1-line error message, and raises a SocketError."""
     try:
-        msg = connection_socket.recv(1024)
+        msg = connection_socket.recv(4096)
     except Exception as e:
         connection_socket.close()
         print("Error receiving client message in STATE_"
-                + state + " at " + time.asctime()
+                + str(state) + " at " + time.asctime()
                 + ". Exception encountered: "
                 + str(e))
         raise SocketError()